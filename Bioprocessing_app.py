@@ -3,9 +3,16 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from scipy.integrate import odeint
+import io
 import os
-import json
+import stat
+import orjson
+import copy
+import tempfile
+from contextlib import nullcontext
+from types import MappingProxyType
+
+from kinetics import integrate_many, integrate_perfusion_many, lttb_indices
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -38,14 +45,20 @@ st.markdown(
 )
 
 # --- Mode Descriptions ---
-mode_descriptions = {
+MODES = ("Batch", "Fed-Batch", "Repeated Fed-Batch", "Bleed-Perfusion")
+MODE_INDEX = {m: i for i, m in enumerate(MODES)}
+
+mode_descriptions = MappingProxyType({
     "Batch": "All nutrients added at the start; no input/output during cultivation. Lowest productivity but simplest operation.",
     "Fed-Batch": "Nutrients added incrementally during cultivation to extend growth. Moderate to high productivity.",
     "Repeated Fed-Batch": "Partial harvest followed by re-feeding; multiple cycles with same inoculum. Better productivity than batch.",
     "Bleed-Perfusion": "Continuous feeding and removal; most cells retained, some removed via bleed. Highest stable productivity."
-}
+})
 
 # --- Scenario File Management ---
+# The scenarios file is parsed once per process and shared; sessions take a deep copy
+# since they add to their scenarios, and saving clears the cache for new sessions.
+@st.cache_resource(show_spinner=False)
 def load_scenarios():
     default_scenarios = {
         "High-Density Perfusion": {
@@ -132,21 +145,44 @@ def load_scenarios():
     }
     
     try:
-        with open('scenarios.json', 'r') as f:
-            return json.load(f)
+        with open('scenarios.json', 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         return default_scenarios
 
 def save_scenarios(scenarios):
-    with open('scenarios.json', 'w') as f:
-        json.dump(scenarios, f, indent=2)
+    # Saves that wouldn't change the file are skipped. Otherwise the new contents go to
+    # a temporary file that replaces scenarios.json in one step, so a failed write can't
+    # leave it truncated (or another session read it half-written).
+    data = orjson.dumps(scenarios, option=orjson.OPT_INDENT_2)
+    try:
+        with open('scenarios.json', 'rb') as f:
+            if f.read() == data:
+                return
+            mode = stat.S_IMODE(os.fstat(f.fileno()).st_mode)
+    except FileNotFoundError:
+        # A new file gets the permissions open() would give it
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmp_path = tempfile.mkstemp(dir='.', prefix='scenarios.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates the file private (0600); keep scenarios.json's permissions
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, 'scenarios.json')
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    load_scenarios.clear()
 
 # --- Initialize Session State ---
 if 'scenarios' not in st.session_state:
-    st.session_state.scenarios = load_scenarios()
+    st.session_state.scenarios = copy.deepcopy(load_scenarios())
 
 # --- Glossary ---
-glossary = {
+glossary = MappingProxyType({
     "Initial Substrate (g/L)": "The starting concentration of the main nutrient for the cells.",
     "Initial Biomass (g/L)": "The starting concentration of cells in the bioreactor.",
     "Max Specific Growth Rate (mu_max, 1/h)": "The maximum rate at which cells can divide per hour.",
@@ -165,6 +201,143 @@ glossary = {
     "Number of Cycles": "The total number of cycles to simulate in a repeated fed-batch process.",
     "Bleed Rate (L/h)": "The rate at which culture is removed from the bioreactor in a perfusion system.",
     "Cell Retention": "The fraction of cells that are retained in the bioreactor during perfusion.",
+})
+# Rendered as one markdown element rather than one per term
+GLOSSARY_MD = "\n\n".join(f"**{term}**: {definition}" for term, definition in glossary.items())
+
+
+# --- Parameter Widgets ---
+# Per parameter: (label, min, max, step, help text)
+PARAM_WIDGETS = {
+    "initial_substrate": ("Initial Substrate (g/L)", 0.1, 100.0, 0.1, glossary["Initial Substrate (g/L)"]),
+    "initial_biomass": ("Initial Biomass (g/L)", 0.1, 10.0, 0.1, glossary["Initial Biomass (g/L)"]),
+    "initial_volume": ("Initial Volume (L)", 0.1, 10.0, 0.1, glossary["Initial Volume (L)"]),
+    "mu_max": ("Max Growth Rate (mu_max, 1/h)", 0.01, 1.0, 0.01, glossary["Max Specific Growth Rate (mu_max, 1/h)"]),
+    "ks": ("Monod Constant (Ks, g/L)", 0.01, 5.0, 0.01, glossary["Monod Constant (Ks, g/L)"]),
+    "Y_xs": ("Biomass Yield (Y_xs, g/g)", 0.1, 1.0, 0.01, glossary["Yield Coefficient (Y_xs, g/g)"]),
+    "Y_xp": ("Product Yield (Y_xp, g/g)", 0.01, 1.0, 0.01, glossary["Product Yield (Y_xp, g/g)"]),
+    "product_name": ("Product Name", glossary["Product Name"]),
+    "feed_substrate": ("Feed [S] (g/L)", 50.0, 500.0, 1.0, glossary["Feed Substrate Concentration (g/L)"]),
+    "exchange_time": ("Exchange Time (h)", 0, 50, 1, glossary["Exchange Time (h)"]),
+    "exchange_volume_percent": ("Exchange Volume (%)", 0, 100, 1, glossary["Exchange Volume (%)"]),
+    "harvest_volume_percent": ("Harvest Volume (%)", 0, 100, 1, glossary["Harvest Volume (%)"]),
+    "first_harvest_time": ("First Harvest Time (h)", 1, 100, 1, glossary["Time of First Harvest (h)"]),
+    "subsequent_harvest_time": ("Time Between Harvests (h)", 1, 100, 1, glossary["Incremental Time for Subsequent Harvests (h)"]),
+    "num_cycles": ("Number of Cycles", 1, 10, 1, glossary["Number of Cycles"]),
+    "feed_rate": ("Feed Rate (L/h)", 0.0, 1.0, 0.01, glossary["Feed Rate (L/h)"]),
+    "bleed_rate": ("Bleed Rate (L/h)", 0.0, 1.0, 0.01, glossary["Bleed Rate (L/h)"]),
+    "cell_retention": ("Cell Retention", 0.0, 1.0, 0.01, glossary["Cell Retention"]),
+}
+
+# Default parameter values per mode, used for anything a loaded scenario doesn't set.
+# Frozen so no session can change the defaults seen by the others.
+MODE_DEFAULTS = MappingProxyType({
+    "Batch": MappingProxyType({
+        "initial_substrate": 20.0, "initial_biomass": 1.0, "initial_volume": 1.0,
+        "mu_max": 0.3, "ks": 0.5, "Y_xs": 0.5, "Y_xp": 0.2, "product_name": "Protein",
+    }),
+    "Fed-Batch": MappingProxyType({
+        "initial_substrate": 10.0, "initial_biomass": 1.0, "initial_volume": 1.0,
+        "mu_max": 0.3, "ks": 0.5, "Y_xs": 0.5, "Y_xp": 0.2, "product_name": "Protein",
+        "feed_substrate": 200.0, "exchange_time": 25, "exchange_volume_percent": 20,
+    }),
+    "Repeated Fed-Batch": MappingProxyType({
+        "initial_substrate": 10.0, "initial_biomass": 1.0, "initial_volume": 1.0,
+        "mu_max": 0.3, "ks": 0.5, "Y_xs": 0.5, "Y_xp": 0.2, "product_name": "Protein",
+        "feed_substrate": 200.0, "harvest_volume_percent": 20, "first_harvest_time": 24,
+        "subsequent_harvest_time": 24, "num_cycles": 3,
+    }),
+    "Bleed-Perfusion": MappingProxyType({
+        "initial_substrate": 50.0, "initial_biomass": 2.0, "initial_volume": 1.0,
+        "mu_max": 0.4, "ks": 0.7, "Y_xs": 0.6, "Y_xp": 0.3, "product_name": "Monoclonal Antibody",
+        "feed_rate": 0.2, "feed_substrate": 300.0, "bleed_rate": 0.02, "cell_retention": 0.95,
+    }),
+})
+
+# Sidebar layout per mode. Sections are (expander title, captions, heading, rows);
+# each row lists the parameters shown side by side.
+_INITIAL_CONDITIONS = [["initial_substrate"], ["initial_biomass"], ["initial_volume"]]
+_GROWTH_KINETICS = ("🦠 Growth Kinetics", [], "##### Monod Model Parameters", [["mu_max"], ["ks"]])
+_YIELD_COEFFICIENTS = ("📈 Yield Coefficients", [], "##### Conversion Efficiencies", [["Y_xs"], ["Y_xp"], ["product_name"]])
+MODE_LAYOUTS = {
+    "Batch": {
+        "key_prefix": "batch",
+        "subheader": None,
+        "fixed": {"initial_volume": 1.0},
+        "sections": [
+            ("📊 Initial Conditions",
+             ["Define the starting biomass, substrate, and volume for the batch process.",
+              "Define the starting state of the bioreactor, including biomass and substrate concentrations."],
+             "##### Bioreactor Starting State", [["initial_substrate"], ["initial_biomass"]]),
+            ("🦠 Growth Kinetics",
+             ["Specify important kinetic parameters such as maximum growth rate and Monod constant for this mode."],
+             "##### Monod Model Parameters", [["mu_max"], ["ks"]]),
+            ("📈 Yield Coefficients",
+             ["Enter biomass and product yield coefficients, which describe how efficiently substrate is converted."],
+             "##### Conversion Efficiencies", [["Y_xs"], ["Y_xp"], ["product_name"]]),
+        ],
+    },
+    "Fed-Batch": {
+        "key_prefix": "fed",
+        "subheader": "🔄 Fed-Batch Configuration",
+        "fixed": {},
+        "sections": [
+            ("📊 Initial Conditions", ["Define the starting biomass, substrate, and volume for the fed-batch process."],
+             "##### Bioreactor Starting State", _INITIAL_CONDITIONS),
+            _GROWTH_KINETICS,
+            _YIELD_COEFFICIENTS,
+            ("🔄 Feeding Strategy", [], "##### Feed & Exchange Parameters",
+             [["feed_substrate"], ["exchange_time"], ["exchange_volume_percent"]]),
+        ],
+    },
+    "Repeated Fed-Batch": {
+        "key_prefix": "rfb",
+        "subheader": "🔁 Repeated Fed-Batch Configuration",
+        "fixed": {},
+        "sections": [
+            ("📊 Initial Conditions", [], "##### Bioreactor Starting State", _INITIAL_CONDITIONS),
+            _GROWTH_KINETICS,
+            _YIELD_COEFFICIENTS,
+            ("🔄 Harvest & Feed Strategy", [], "##### Cycle Parameters",
+             [["feed_substrate", "harvest_volume_percent"], ["first_harvest_time"], ["subsequent_harvest_time"], ["num_cycles"]]),
+        ],
+    },
+    "Bleed-Perfusion": {
+        "key_prefix": "bp",
+        "subheader": "🔬 Bleed-Perfusion Configuration",
+        "fixed": {},
+        "sections": [
+            ("📊 Initial Conditions", [], "##### Bioreactor Starting State", _INITIAL_CONDITIONS),
+            _GROWTH_KINETICS,
+            _YIELD_COEFFICIENTS,
+            ("⚡ Perfusion Operation", [], "##### Feed & Bleed Control",
+             [["feed_rate", "bleed_rate"], ["feed_substrate"], ["cell_retention"]]),
+        ],
+    },
+}
+
+# --- Assignment Questions ---
+ASSIGNMENT_QUESTIONS = {
+    "Batch": [
+        "Why does the biomass concentration plateau in batch culture?",
+        "What limits the final biomass concentration achieved?",
+        "How would increasing the initial substrate concentration affect the results?"
+    ],
+    "Fed-Batch": [
+        "How does the feeding strategy affect biomass productivity?",
+        "What are the advantages of fed-batch over batch culture?",
+        "How would you optimize the feed rate for maximum productivity?"
+    ],
+    "Repeated Fed-Batch": [
+        "What are the benefits of multiple cycles compared to single batch?",
+        "How does the harvest volume affect overall productivity?",
+        "What factors determine the optimal cycle time?"
+    ],
+    "Bleed-Perfusion": [
+        "Why can perfusion systems achieve the highest productivity?",
+        "How does cell retention efficiency affect the process?",
+        "What are the main challenges in operating perfusion systems?"
+    ]
 }
 
 # Runtime confirmation for debugging: make it obvious which app code is loaded
@@ -186,18 +359,16 @@ loaded_scenario = st.sidebar.selectbox("Load a scenario", ["None"] + scenario_na
 
 if loaded_scenario != "None":
     scenario_data = st.session_state.scenarios[loaded_scenario]
-    mode = st.sidebar.selectbox(
-        "Choose a bioreactor operation mode:",
-        ["Batch", "Fed-Batch", "Repeated Fed-Batch", "Bleed-Perfusion"],
-        index=["Batch", "Fed-Batch", "Repeated Fed-Batch", "Bleed-Perfusion"].index(scenario_data['mode'])
-    )
+    mode_index = MODE_INDEX[scenario_data['mode']]
     params = scenario_data['params']
 else:
-    mode = st.sidebar.selectbox(
-        "Choose a bioreactor operation mode:",
-        ["Batch", "Fed-Batch", "Repeated Fed-Batch", "Bleed-Perfusion"],
-    )
+    mode_index = 0
     params = {}
+mode = st.sidebar.selectbox(
+    "Choose a bioreactor operation mode:",
+    MODES,
+    index=mode_index
+)
 
 # Display mode description
 st.sidebar.info(f"**{mode} Mode**: {mode_descriptions[mode]}")
@@ -213,476 +384,48 @@ expand_all = st.sidebar.checkbox(
     key='expand_all'
 )
 
-if mode == "Batch":
-    with st.sidebar.expander("📊 Initial Conditions", expanded=expand_all):
-        st.caption("Define the starting biomass, substrate, and volume for the batch process.")
-        st.caption("Define the starting state of the bioreactor, including biomass and substrate concentrations.")
-        st.markdown("##### Bioreactor Starting State")
-        
-        initial_substrate = st.slider("Initial Substrate (g/L)", 0.1, 100.0,
-            params.get('initial_substrate', 20.0),
-            help=glossary["Initial Substrate (g/L)"],
-            disabled=assignment_mode)
-        initial_substrate = st.number_input("Direct input:", value=initial_substrate,
-            min_value=0.1, max_value=100.0, step=0.1,
-            key="batch_substrate", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        initial_biomass = st.slider("Initial Biomass (g/L)", 0.1, 10.0,
-            params.get('initial_biomass', 1.0),
-            help=glossary["Initial Biomass (g/L)"],
-            disabled=assignment_mode)
-        initial_biomass = st.number_input("Direct input:", value=initial_biomass,
-            min_value=0.1, max_value=10.0, step=0.1,
-            key="batch_biomass", disabled=assignment_mode,
-            label_visibility="collapsed")
-    
-    # Growth Kinetics Section
-    with st.sidebar.expander("🦠 Growth Kinetics", expanded=expand_all):
-        st.caption("Specify important kinetic parameters such as maximum growth rate and Monod constant for this mode.")
-        st.markdown("##### Monod Model Parameters")
-        
-        mu_max = st.slider("Max Growth Rate (mu_max, 1/h)", 0.01, 1.0,
-            params.get('mu_max', 0.3),
-            help=glossary["Max Specific Growth Rate (mu_max, 1/h)"],
-            disabled=assignment_mode)
-        mu_max = st.number_input("Direct input:", value=mu_max,
-            min_value=0.01, max_value=1.0, step=0.01,
-            key="batch_mu_max", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        ks = st.slider("Monod Constant (Ks, g/L)", 0.01, 5.0,
-            params.get('ks', 0.5),
-            help=glossary["Monod Constant (Ks, g/L)"],
-            disabled=assignment_mode)
-        ks = st.number_input("Direct input:", value=ks,
-            min_value=0.01, max_value=5.0, step=0.01,
-                    key="batch_ks", disabled=assignment_mode,
-                    label_visibility="collapsed")
-                
-    # Yield Coefficients Section
-    with st.sidebar.expander("📈 Yield Coefficients", expanded=expand_all):
-        st.caption("Enter biomass and product yield coefficients, which describe how efficiently substrate is converted.")
-        st.markdown("##### Conversion Efficiencies")
-        
-        Y_xs = st.slider("Biomass Yield (Y_xs, g/g)", 0.1, 1.0,
-            params.get('Y_xs', 0.5),
-            help=glossary["Yield Coefficient (Y_xs, g/g)"],
-            disabled=assignment_mode)
-        Y_xs = st.number_input("Direct input:", value=Y_xs,
-            min_value=0.1, max_value=1.0, step=0.01,
-            key="batch_Y_xs", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        Y_xp = st.slider("Product Yield (Y_xp, g/g)", 0.01, 1.0,
-            params.get('Y_xp', 0.2),
-            help=glossary["Product Yield (Y_xp, g/g)"],
-            disabled=assignment_mode)
-        Y_xp = st.number_input("Direct input:", value=Y_xp,
-            min_value=0.01, max_value=1.0, step=0.01,
-            key="batch_Y_xp", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        product_name = st.text_input("Product Name",
-            params.get('product_name', 'Protein'),
-            help=glossary["Product Name"],
-            disabled=assignment_mode,
-            key="batch_product_name")
-    current_params = {"initial_substrate": initial_substrate, "initial_biomass": initial_biomass, "initial_volume": 1.0, "mu_max": mu_max, "ks": ks, "Y_xs": Y_xs, "Y_xp": Y_xp, "product_name": product_name}
-
-elif mode == "Fed-Batch":
-    st.sidebar.subheader("🔄 Fed-Batch Configuration")
-    
-    # Initial Conditions Section
-    with st.sidebar.expander("📊 Initial Conditions", expanded=expand_all):
-        st.caption("Define the starting biomass, substrate, and volume for the fed-batch process.")
-        st.markdown("##### Bioreactor Starting State")
-        
-        initial_substrate = st.slider("Initial Substrate (g/L)", 0.1, 100.0,
-            params.get('initial_substrate', 10.0),
-            help=glossary["Initial Substrate (g/L)"],
-            disabled=assignment_mode)
-        initial_substrate = st.number_input("Direct input:", value=initial_substrate,
-            min_value=0.1, max_value=100.0, step=0.1,
-            key="fed_substrate", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        initial_biomass = st.slider("Initial Biomass (g/L)", 0.1, 10.0,
-            params.get('initial_biomass', 1.0),
-            help=glossary["Initial Biomass (g/L)"],
-            disabled=assignment_mode)
-        initial_biomass = st.number_input("Direct input:", value=initial_biomass,
-            min_value=0.1, max_value=10.0, step=0.1,
-            key="fed_biomass", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        initial_volume = st.slider("Initial Volume (L)", 0.1, 10.0,
-            params.get('initial_volume', 1.0),
-            help=glossary["Initial Volume (L)"],
-            disabled=assignment_mode)
-        initial_volume = st.number_input("Direct input:", value=initial_volume,
-            min_value=0.1, max_value=10.0, step=0.1,
-            key="fed_volume", disabled=assignment_mode,
-            label_visibility="collapsed")
-    
-    # Growth Kinetics Section
-    with st.sidebar.expander("🦠 Growth Kinetics", expanded=expand_all):
-        st.markdown("##### Monod Model Parameters")
-        
-        mu_max = st.slider("Max Growth Rate (mu_max, 1/h)", 0.01, 1.0,
-            params.get('mu_max', 0.3),
-            help=glossary["Max Specific Growth Rate (mu_max, 1/h)"],
-            disabled=assignment_mode)
-        mu_max = st.number_input("Direct input:", value=mu_max,
-            min_value=0.01, max_value=1.0, step=0.01,
-            key="fed_mu_max", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        ks = st.slider("Monod Constant (Ks, g/L)", 0.01, 5.0,
-            params.get('ks', 0.5),
-            help=glossary["Monod Constant (Ks, g/L)"],
-            disabled=assignment_mode)
-        ks = st.number_input("Direct input:", value=ks,
-            min_value=0.01, max_value=5.0, step=0.01,
-            key="fed_ks", disabled=assignment_mode,
-            label_visibility="collapsed")
-    
-    # Yield Coefficients Section
-    with st.sidebar.expander("📈 Yield Coefficients", expanded=expand_all):
-        st.markdown("##### Conversion Efficiencies")
-        
-        Y_xs = st.slider("Biomass Yield (Y_xs, g/g)", 0.1, 1.0,
-            params.get('Y_xs', 0.5),
-            help=glossary["Yield Coefficient (Y_xs, g/g)"],
-            disabled=assignment_mode)
-        Y_xs = st.number_input("Direct input:", value=Y_xs,
-            min_value=0.1, max_value=1.0, step=0.01,
-            key="fed_Y_xs", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        Y_xp = st.slider("Product Yield (Y_xp, g/g)", 0.01, 1.0,
-            params.get('Y_xp', 0.2),
-            help=glossary["Product Yield (Y_xp, g/g)"],
-            disabled=assignment_mode)
-        Y_xp = st.number_input("Direct input:", value=Y_xp,
-            min_value=0.01, max_value=1.0, step=0.01,
-            key="fed_Y_xp", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        product_name = st.text_input("Product Name",
-            params.get('product_name', 'Protein'),
-            help=glossary["Product Name"],
-            disabled=assignment_mode,
-            key="fed_product_name")
-    
-    # Feeding Strategy Section
-    with st.sidebar.expander("🔄 Feeding Strategy", expanded=expand_all):
-        st.markdown("##### Feed & Exchange Parameters")
-        
-        feed_substrate = st.slider("Feed [S] (g/L)", 50.0, 500.0,
-            params.get('feed_substrate', 200.0),
-            help=glossary["Feed Substrate Concentration (g/L)"],
-            disabled=assignment_mode)
-        feed_substrate = st.number_input("Direct input:", value=feed_substrate,
-            min_value=50.0, max_value=500.0, step=1.0,
-            key="fed_feed_substrate", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        exchange_time = st.slider("Exchange Time (h)", 0, 50,
-            params.get('exchange_time', 25),
-            help=glossary["Exchange Time (h)"],
-            disabled=assignment_mode)
-        exchange_time = st.number_input("Direct input:", value=exchange_time,
-            min_value=0, max_value=50, step=1,
-            key="fed_exchange_time", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        exchange_volume_percent = st.slider("Exchange Volume (%)", 0, 100,
-            params.get('exchange_volume_percent', 20),
-            help=glossary["Exchange Volume (%)"],
-            disabled=assignment_mode)
-        exchange_volume_percent = st.number_input("Direct input:", value=exchange_volume_percent,
-            min_value=0, max_value=100, step=1,
-            key="fed_exchange_volume", disabled=assignment_mode,
-            label_visibility="collapsed")
-    
-    current_params = {"initial_substrate": initial_substrate, "initial_biomass": initial_biomass, "initial_volume": initial_volume, "mu_max": mu_max, "ks": ks, "Y_xs": Y_xs, "Y_xp": Y_xp, "product_name": product_name, "feed_substrate": feed_substrate, "exchange_time": exchange_time, "exchange_volume_percent": exchange_volume_percent}
-
-elif mode == "Repeated Fed-Batch":
-    st.sidebar.subheader("🔁 Repeated Fed-Batch Configuration")
-    
-    # Initial Conditions Section
-    with st.sidebar.expander("📊 Initial Conditions", expanded=expand_all):
-        st.markdown("##### Bioreactor Starting State")
-        
-        initial_substrate = st.slider("Initial Substrate (g/L)", 0.1, 100.0,
-            params.get('initial_substrate', 10.0),
-            help=glossary["Initial Substrate (g/L)"],
-            disabled=assignment_mode)
-        initial_substrate = st.number_input("Direct input:", value=initial_substrate,
-            min_value=0.1, max_value=100.0, step=0.1,
-            key="rfb_substrate", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        initial_biomass = st.slider("Initial Biomass (g/L)", 0.1, 10.0,
-            params.get('initial_biomass', 1.0),
-            help=glossary["Initial Biomass (g/L)"],
-            disabled=assignment_mode)
-        initial_biomass = st.number_input("Direct input:", value=initial_biomass,
-            min_value=0.1, max_value=10.0, step=0.1,
-            key="rfb_biomass", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        initial_volume = st.slider("Initial Volume (L)", 0.1, 10.0,
-            params.get('initial_volume', 1.0),
-            help=glossary["Initial Volume (L)"],
-            disabled=assignment_mode)
-        initial_volume = st.number_input("Direct input:", value=initial_volume,
-            min_value=0.1, max_value=10.0, step=0.1,
-            key="rfb_volume", disabled=assignment_mode,
-            label_visibility="collapsed")
-    
-    # Growth Kinetics Section
-    with st.sidebar.expander("🦠 Growth Kinetics", expanded=expand_all):
-        st.markdown("##### Monod Model Parameters")
-        
-        mu_max = st.slider("Max Growth Rate (mu_max, 1/h)", 0.01, 1.0,
-            params.get('mu_max', 0.3),
-            help=glossary["Max Specific Growth Rate (mu_max, 1/h)"],
-            disabled=assignment_mode)
-        mu_max = st.number_input("Direct input:", value=mu_max,
-            min_value=0.01, max_value=1.0, step=0.01,
-            key="rfb_mu_max", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        ks = st.slider("Monod Constant (Ks, g/L)", 0.01, 5.0,
-            params.get('ks', 0.5),
-            help=glossary["Monod Constant (Ks, g/L)"],
-            disabled=assignment_mode)
-        ks = st.number_input("Direct input:", value=ks,
-            min_value=0.01, max_value=5.0, step=0.01,
-            key="rfb_ks", disabled=assignment_mode,
-            label_visibility="collapsed")
-    
-    # Yield Coefficients Section
-    with st.sidebar.expander("📈 Yield Coefficients", expanded=expand_all):
-        st.markdown("##### Conversion Efficiencies")
-        
-        Y_xs = st.slider("Biomass Yield (Y_xs, g/g)", 0.1, 1.0,
-            params.get('Y_xs', 0.5),
-            help=glossary["Yield Coefficient (Y_xs, g/g)"],
-            disabled=assignment_mode)
-        Y_xs = st.number_input("Direct input:", value=Y_xs,
-            min_value=0.1, max_value=1.0, step=0.01,
-            key="rfb_Y_xs", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        Y_xp = st.slider("Product Yield (Y_xp, g/g)", 0.01, 1.0,
-            params.get('Y_xp', 0.2),
-            help=glossary["Product Yield (Y_xp, g/g)"],
-            disabled=assignment_mode)
-        Y_xp = st.number_input("Direct input:", value=Y_xp,
-            min_value=0.01, max_value=1.0, step=0.01,
-            key="rfb_Y_xp", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        product_name = st.text_input("Product Name",
-            params.get('product_name', 'Protein'),
-            help=glossary["Product Name"],
-            disabled=assignment_mode,
-            key="rfb_product_name")
-    
-    # Harvest & Feed Strategy Section
-    with st.sidebar.expander("🔄 Harvest & Feed Strategy", expanded=expand_all):
-        st.markdown("##### Cycle Parameters")
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            feed_substrate = st.slider("Feed [S] (g/L)", 50.0, 500.0,
-                params.get('feed_substrate', 200.0),
-                help=glossary["Feed Substrate Concentration (g/L)"],
-                disabled=assignment_mode)
-            feed_substrate = st.number_input("Direct input:", value=feed_substrate,
-                min_value=50.0, max_value=500.0, step=1.0,
-                key="rfb_feed_substrate", disabled=assignment_mode,
-                label_visibility="collapsed")
-        
-        with col2:
-            harvest_volume_percent = st.slider("Harvest Volume (%)", 0, 100,
-                params.get('harvest_volume_percent', 20),
-                help=glossary["Harvest Volume (%)"],
-                disabled=assignment_mode)
-            harvest_volume_percent = st.number_input("Direct input:", value=harvest_volume_percent,
-                min_value=0, max_value=100, step=1,
-                key="rfb_harvest_volume", disabled=assignment_mode,
-                label_visibility="collapsed")
-        
-        # First harvest and subsequent schedule
-        first_harvest_time = st.slider("First Harvest Time (h)", 1, 100,
-            params.get('first_harvest_time', 24),
-            help="Time for the first harvest/feeding pulse.",
-            disabled=assignment_mode)
-        first_harvest_time = st.number_input("Direct input:", value=first_harvest_time,
-            min_value=1, max_value=100, step=1,
-            key="rfb_first_harvest_time", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        subsequent_harvest_time = st.slider("Time Between Harvests (h)", 1, 100,
-            params.get('subsequent_harvest_time', 24),
-            help="Time between subsequent harvest/feeding pulses.",
-            disabled=assignment_mode)
-        subsequent_harvest_time = st.number_input("Direct input:", value=subsequent_harvest_time,
-            min_value=1, max_value=100, step=1,
-            key="rfb_subsequent_harvest_time", disabled=assignment_mode,
-            label_visibility="collapsed")
-        
-        num_cycles = st.slider("Number of Cycles", 1, 10, params.get('num_cycles', 3), help=glossary["Number of Cycles"], disabled=assignment_mode)
-        num_cycles = st.number_input("Direct input:", value=num_cycles, min_value=1, max_value=10, step=1, key="rfb_num_cycles", disabled=assignment_mode, label_visibility="collapsed")
-
-    current_params = {"initial_substrate": initial_substrate, "initial_biomass": initial_biomass, "initial_volume": initial_volume, "mu_max": mu_max, "ks": ks, "Y_xs": Y_xs, "Y_xp": Y_xp, "product_name": product_name, "feed_substrate": feed_substrate, "harvest_volume_percent": harvest_volume_percent, "first_harvest_time": first_harvest_time, "subsequent_harvest_time": subsequent_harvest_time, "num_cycles": num_cycles}
-
-elif mode == "Bleed-Perfusion":
-    st.sidebar.subheader("🔬 Bleed-Perfusion Configuration")
-    
-    # Initial Conditions Section
-    with st.sidebar.expander("📊 Initial Conditions", expanded=expand_all):
-        st.markdown("##### Bioreactor Starting State")
-        
-        initial_substrate = st.slider("Initial Substrate (g/L)", 0.1, 100.0, 
-            params.get('initial_substrate', 50.0), 
-            help=glossary["Initial Substrate (g/L)"], 
-            disabled=assignment_mode)
-        initial_substrate = st.number_input("Direct input:", value=initial_substrate, 
-            min_value=0.1, max_value=100.0, step=0.1, 
-            key="bp_substrate", disabled=assignment_mode, 
-            label_visibility="collapsed")
-        
-        initial_biomass = st.slider("Initial Biomass (g/L)", 0.1, 10.0, 
-            params.get('initial_biomass', 2.0), 
-            help=glossary["Initial Biomass (g/L)"], 
-            disabled=assignment_mode)
-        initial_biomass = st.number_input("Direct input:", value=initial_biomass, 
-            min_value=0.1, max_value=10.0, step=0.1, 
-            key="bp_biomass", disabled=assignment_mode, 
-            label_visibility="collapsed")
-        
-        initial_volume = st.slider("Initial Volume (L)", 0.1, 10.0, 
-            params.get('initial_volume', 1.0), 
-            help=glossary["Initial Volume (L)"], 
-            disabled=assignment_mode)
-        initial_volume = st.number_input("Direct input:", value=initial_volume, 
-            min_value=0.1, max_value=10.0, step=0.1, 
-            key="bp_volume", disabled=assignment_mode, 
-            label_visibility="collapsed")
-    
-    # Growth Kinetics Section
-    with st.sidebar.expander("🦠 Growth Kinetics", expanded=expand_all):
-        st.markdown("##### Monod Model Parameters")
-        
-        mu_max = st.slider("Max Growth Rate (mu_max, 1/h)", 0.01, 1.0, 
-            params.get('mu_max', 0.4), 
-            help=glossary["Max Specific Growth Rate (mu_max, 1/h)"], 
-            disabled=assignment_mode)
-        mu_max = st.number_input("Direct input:", value=mu_max, 
-            min_value=0.01, max_value=1.0, step=0.01, 
-            key="bp_mu_max", disabled=assignment_mode, 
-            label_visibility="collapsed")
-        
-        ks = st.slider("Monod Constant (Ks, g/L)", 0.01, 5.0, 
-            params.get('ks', 0.7), 
-            help=glossary["Monod Constant (Ks, g/L)"], 
-            disabled=assignment_mode)
-        ks = st.number_input("Direct input:", value=ks, 
-            min_value=0.01, max_value=5.0, step=0.01, 
-            key="bp_ks", disabled=assignment_mode, 
-            label_visibility="collapsed")
-    
-    # Yield Coefficients Section
-    with st.sidebar.expander("📈 Yield Coefficients", expanded=expand_all):
-        st.markdown("##### Conversion Efficiencies")
-        
-        Y_xs = st.slider("Biomass Yield (Y_xs, g/g)", 0.1, 1.0, 
-            params.get('Y_xs', 0.6), 
-            help=glossary["Yield Coefficient (Y_xs, g/g)"], 
-            disabled=assignment_mode)
-        Y_xs = st.number_input("Direct input:", value=Y_xs, 
-            min_value=0.1, max_value=1.0, step=0.01, 
-            key="bp_Y_xs", disabled=assignment_mode, 
-            label_visibility="collapsed")
-        
-        Y_xp = st.slider("Product Yield (Y_xp, g/g)", 0.01, 1.0, 
-            params.get('Y_xp', 0.3), 
-            help=glossary["Product Yield (Y_xp, g/g)"], 
-            disabled=assignment_mode)
-        Y_xp = st.number_input("Direct input:", value=Y_xp, 
-            min_value=0.01, max_value=1.0, step=0.01, 
-            key="bp_Y_xp", disabled=assignment_mode, 
-            label_visibility="collapsed")
-        
-        product_name = st.text_input("Product Name", 
-            params.get('product_name', 'Monoclonal Antibody'), 
-            help=glossary["Product Name"], 
-            disabled=assignment_mode, 
-            key="bp_product_name")
-    
-    # Perfusion Operation Section
-    with st.sidebar.expander("⚡ Perfusion Operation", expanded=expand_all):
-        st.markdown("##### Feed & Bleed Control")
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            feed_rate = st.slider("Feed Rate (L/h)", 0.0, 1.0, 
-                params.get('feed_rate', 0.2), 
-                help=glossary["Feed Rate (L/h)"], 
-                disabled=assignment_mode)
-            feed_rate = st.number_input("Direct input:", value=feed_rate, 
-                min_value=0.0, max_value=1.0, step=0.01, 
-                key="bp_feed_rate", disabled=assignment_mode, 
-                label_visibility="collapsed")
-        
-        with col2:
-            bleed_rate = st.slider("Bleed Rate (L/h)", 0.0, 1.0, 
-                params.get('bleed_rate', 0.02), 
-                help=glossary["Bleed Rate (L/h)"], 
-                disabled=assignment_mode)
-            bleed_rate = st.number_input("Direct input:", value=bleed_rate, 
-                min_value=0.0, max_value=1.0, step=0.01, 
-                key="bp_bleed_rate", disabled=assignment_mode, 
-                label_visibility="collapsed")
-        
-        feed_substrate = st.slider("Feed [S] (g/L)", 50.0, 500.0, 
-            params.get('feed_substrate', 300.0), 
-            help=glossary["Feed Substrate Concentration (g/L)"], 
-            disabled=assignment_mode)
-        feed_substrate = st.number_input("Direct input:", value=feed_substrate, 
-            min_value=50.0, max_value=500.0, step=1.0, 
-            key="bp_feed_substrate", disabled=assignment_mode, 
-            label_visibility="collapsed")
-        
-        cell_retention = st.slider("Cell Retention", 0.0, 1.0, 
-            params.get('cell_retention', 0.95), 
-            help=glossary["Cell Retention"], 
-            disabled=assignment_mode)
-        cell_retention = st.number_input("Direct input:", value=cell_retention, 
-            min_value=0.0, max_value=1.0, step=0.01, 
-            key="bp_cell_retention", disabled=assignment_mode, 
-            label_visibility="collapsed")
-    
-    # Basic parameters dictionary for simple Monod model
-    current_params = {
-        "initial_substrate": initial_substrate,
-        "initial_biomass": initial_biomass,
-        "initial_volume": initial_volume,
-        "mu_max": mu_max,
-        "ks": ks,
-        "Y_xs": Y_xs,
-        "Y_xp": Y_xp,
-        "product_name": product_name,
-        "feed_rate": feed_rate,
-        "feed_substrate": feed_substrate,
-        "bleed_rate": bleed_rate,
-        "cell_retention": cell_retention
-    }
+def param_input(name, value, key_prefix):
+    if name == "product_name":
+        label, help_text = PARAM_WIDGETS[name]
+        return st.text_input(label, value, help=help_text,
+            disabled=assignment_mode, key=f"{key_prefix}_product_name")
+    label, min_value, max_value, step, help_text = PARAM_WIDGETS[name]
+    return st.slider(label, min_value, max_value,
+        value, step=step,
+        help=help_text,
+        disabled=assignment_mode)
+
+layout = MODE_LAYOUTS[mode]
+initial_values = {**MODE_DEFAULTS[mode], **params}
+
+# Parameters live in a form so adjusting several sliders triggers a single rerun on
+# "Simulate"; until then every rerun keeps using the last submitted values.
+current_params = {}
+with st.sidebar.form("params"):
+    if layout["subheader"]:
+        st.subheader(layout["subheader"])
+    for title, captions, heading, rows in layout["sections"]:
+        with st.expander(title, expanded=expand_all):
+            for caption in captions:
+                st.caption(caption)
+            st.markdown(heading)
+            for row in rows:
+                # Rows with two parameters are laid out side by side
+                cells = st.columns(len(row)) if len(row) > 1 else [nullcontext()]
+                for name, cell in zip(row, cells):
+                    with cell:
+                        current_params[name] = param_input(name, initial_values[name], layout["key_prefix"])
+    st.form_submit_button("Simulate", disabled=assignment_mode, use_container_width=True)
+    # Saving submits the form as well, so the saved scenario is what the sliders show
+    with st.expander("🛠️ Scenario Builder", expanded=False):
+        scenario_name = st.text_input("Enter scenario name to save", "MyScenario")
+        save_submitted = st.form_submit_button("Save Scenario")
+current_params.update(layout["fixed"])
+
+if save_submitted:
+    st.session_state.scenarios[scenario_name] = {"mode": mode, "params": current_params}
+    save_scenarios(st.session_state.scenarios)
+    st.sidebar.success(f"Scenario '{scenario_name}' saved to scenarios.json!")
 
 
 # --- Productivity Calculations ---
@@ -690,16 +433,19 @@ def calculate_productivity_metrics(df, mode, params):
     metrics = {}
     
     if not df.empty:
-        final_biomass = df['Biomass (g/L)'].iloc[-1]
-        initial_biomass = df['Biomass (g/L)'].iloc[0]
-        total_time = df['Time (h)'].iloc[-1]
+        # Pull the columns out once and read the end points from the arrays
+        time = df['Time (h)'].to_numpy()
+        biomass = df['Biomass (g/L)'].to_numpy()
+        substrate = df['Substrate (g/L)'].to_numpy()
+        final_biomass, initial_biomass = biomass[-1], biomass[0]
+        total_time = time[-1]
         
         # Product metrics
         product_name = params.get('product_name', 'Product')
         product_col = f"{product_name} (g/L)"
         if product_col in df.columns:
-            final_product = df[product_col].iloc[-1]
-            initial_product = df[product_col].iloc[0]
+            product = df[product_col].to_numpy()
+            final_product, initial_product = product[-1], product[0]
         else:
             final_product = initial_product = 0
         
@@ -711,7 +457,7 @@ def calculate_productivity_metrics(df, mode, params):
             metrics['Total Product Produced (g)'] = final_product * initial_volume
             
         elif mode == "Fed-Batch":
-            final_volume = df['Volume (L)'].iloc[-1] if 'Volume (L)' in df.columns else params.get('initial_volume', 1.0)
+            final_volume = df['Volume (L)'].to_numpy()[-1] if 'Volume (L)' in df.columns else params.get('initial_volume', 1.0)
             metrics['Biomass Productivity (g/L/h)'] = (final_biomass - initial_biomass) / total_time
             metrics['Product Productivity (g/L/h)'] = final_product / total_time
             metrics['Total Biomass Produced (g)'] = final_biomass * final_volume
@@ -721,25 +467,17 @@ def calculate_productivity_metrics(df, mode, params):
             num_cycles = params.get('num_cycles', 3)
             harvest_volume_percent = params.get('harvest_volume_percent', 20)
             
-            # Find harvest events by looking for drops in volume
-            volume_changes = df['Volume (L)'].diff().fillna(0)
-            harvest_events = df[volume_changes < -0.001]
-            
-            total_product_harvested = 0
-            total_biomass_harvested = 0
-            for index, event in harvest_events.iterrows():
-                # Concentrations just before the harvest
-                product_conc_before = df.loc[index - 1, product_col]
-                biomass_conc_before = df.loc[index - 1, 'Biomass (g/L)']
-                # Volume harvested
-                volume_before = df.loc[index - 1, 'Volume (L)']
-                harvest_volume = volume_before * (harvest_volume_percent / 100.0)
-                
-                total_product_harvested += product_conc_before * harvest_volume
-                total_biomass_harvested += biomass_conc_before * harvest_volume
+            # Find harvest events by looking for drops in volume; take the
+            # concentrations and volume from the rows just before each harvest
+            volume = df['Volume (L)'].to_numpy()
+            before = np.flatnonzero(np.diff(volume) < -0.001)
+            harvest_volume = volume[before] * (harvest_volume_percent / 100.0)
+
+            total_product_harvested = (product[before] * harvest_volume).sum()
+            total_biomass_harvested = (biomass[before] * harvest_volume).sum()
 
             # Add the final amount remaining in the reactor to the total harvested amount
-            final_volume = df['Volume (L)'].iloc[-1]
+            final_volume = volume[-1]
             total_biomass_produced = total_biomass_harvested + (final_biomass * final_volume)
             total_product_produced = total_product_harvested + (final_product * final_volume)
 
@@ -763,8 +501,8 @@ def calculate_productivity_metrics(df, mode, params):
             metrics['Total Biomass Produced (g)'] = final_biomass * volume
             metrics['Total Product Produced (g)'] = final_product * volume
         
-        initial_substrate = df['Substrate (g/L)'].iloc[0]
-        final_substrate = df['Substrate (g/L)'].iloc[-1]
+        initial_substrate = substrate[0]
+        final_substrate = substrate[-1]
         substrate_consumed = initial_substrate - final_substrate
         
         if substrate_consumed > 0:
@@ -775,8 +513,8 @@ def calculate_productivity_metrics(df, mode, params):
             metrics['Substrate to Product Efficiency'] = 0
             
         if len(df) > 1:
-            growth_rates = np.diff(np.log(df['Biomass (g/L)'])) / np.diff(df['Time (h)'])
-            metrics['Max Growth Rate Achieved (1/h)'] = np.max(growth_rates[growth_rates > 0]) if len(growth_rates[growth_rates > 0]) > 0 else 0
+            growth_rates = np.diff(np.log(biomass)) / np.diff(time)
+            metrics['Max Growth Rate Achieved (1/h)'] = growth_rates[growth_rates > 0].max(initial=0.0)
         else:
             metrics['Max Growth Rate Achieved (1/h)'] = 0
     
@@ -784,93 +522,6 @@ def calculate_productivity_metrics(df, mode, params):
 
 
 # --- Kinetics Engine ---
-def batch_kinetics(y, t, mu_max, Ks, Y_xs, Y_xp):
-    X, S, P = y
-    mu = mu_max * S / (Ks + S)
-    dX_dt = mu * X
-    dS_dt = -1/Y_xs * dX_dt
-    dP_dt = Y_xp * dX_dt
-    return [dX_dt, dS_dt, dP_dt]
-
-def fed_batch_kinetics(y, t, mu_max, Ks, Y_xs, Y_xp, F, V, Sf):
-    X, S, P = y
-    mu = mu_max * S / (Ks + S)
-    D = F / V
-    dX_dt = mu * X - D * X
-    dS_dt = D * (Sf - S) - (mu * X / Y_xs)
-    dP_dt = Y_xp * mu * X - D * P
-    return [dX_dt, dS_dt, dP_dt]
-
-def perfusion_kinetics(y, t, mu_max, Ks, Y_xs, Y_xp, D, Sf, R, D_bleed):
-    """
-    Perfusion bioreactor kinetics with substrate-dependent culture crash.
-    
-    Key Features:
-    1. Monod growth until substrate depletion
-    2. Complete crash at critical substrate level (0.0015% of peak)
-    3. No biological recovery after crash
-    4. Physical processes (dilution) continue post-crash
-    
-    Args:
-        y: [X, S, P] - Biomass, Substrate, Product (g/L)
-        mu_max: maximum growth rate (1/h)
-        Ks: Monod constant (g/L)
-        Y_xs: biomass yield (g X/g S)
-        Y_xp: product yield (g P/g X)
-        D: feed dilution rate (1/h)
-        Sf: feed substrate (g/L)
-        R: cell retention (0-1)
-        D_bleed: bleed dilution rate (1/h)
-    """
-    # Extract current state
-    X, S, P = y
-    S = max(0.0, S)  # Ensure non-negative substrate    
-    
-    # Track maximum substrate concentration
-    if not hasattr(perfusion_kinetics, 'S_max'):
-        perfusion_kinetics.S_max = max(Sf, S)
-    perfusion_kinetics.S_max = max(perfusion_kinetics.S_max, S)
-    
-    # Critical substrate threshold for crash (0.0015% of peak)
-    S_threshold = 0.000015 * perfusion_kinetics.S_max
-    
-    # Culture state determination
-    if S <= S_threshold:
-        # CRASH STATE: Complete cessation of biological activity
-        dX_dt = -(1 - R) * D * X - D_bleed * X # Cell washout by overflow and bleed
-        dS_dt = D * (Sf - S) - D_bleed * S     # Substrate dilution by feed, washout by overflow and bleed
-        dP_dt = -D * P - D_bleed * P           # Product washout by overflow and bleed
-        
-        # Store crash state for UI indicators
-        perfusion_kinetics.crashed = True
-        
-    else:
-        # NORMAL OPERATION: Active cell growth
-        mu = mu_max * S / (Ks + S)
-        
-        # Cell mass balance
-        cell_growth = mu * X                     # Growth
-        cell_overflow = -(1.0 - R) * D * X       # Overflow loss (imperfect retention)
-        cell_bleed = -D_bleed * X                # Controlled removal via bleed
-        dX_dt = cell_growth + cell_overflow + cell_bleed
-        
-        # Substrate mass balance
-        substrate_in = D * Sf                    # Feed in
-        substrate_out = -D * S                   # Total liquid out (permeate + bleed)
-        substrate_consumed = -(mu * X / Y_xs)    # Consumption by cells
-        dS_dt = substrate_in + substrate_out + substrate_consumed
-        
-        # Product mass balance
-        product_formation = Y_xp * mu * X        # Formation by cells
-        product_out = -D * P                     # Total product removal (harvest)
-        dP_dt = product_formation + product_out
-        
-        # Update crash tracking
-        perfusion_kinetics.crashed = False
-    
-    return [dX_dt, dS_dt, dP_dt]
-
-
 def unified_cstr_kinetics(y, t,
                           mu_max, Ks,
                           Y_G, m,
@@ -933,250 +584,218 @@ def unified_cstr_kinetics(y, t,
     return [dX_dt, dS_dt, dP_dt]
 
 # --- Simulation Runner ---
-def run_simulation(mode, params):
-    t_span = np.linspace(0, 50, 500)
-    
+# Runs are simulated by simulate_runs and overlays by simulate_scenarios, both cached on
+# the mode and params, so reruns that don't change them - e.g. toggling a display
+# option - skip integration.
+def trajectory_frame(t, sol, product_name, volume=None, run=None):
+    data = {"Time (h)": t, "Biomass (g/L)": sol[:, 0], "Substrate (g/L)": sol[:, 1], f"{product_name} (g/L)": sol[:, 2]}
+    if volume is not None:
+        data["Volume (L)"] = np.full(len(t), volume)
+    if run is not None:
+        data["Run"] = run
+    return pd.DataFrame(data)
+
+# Time grids depend only on the schedule, so they are built once per process and
+# shared between sessions; they are marked read-only since every run sees the same array.
+def _read_only(*arrays):
+    for a in arrays:
+        a.flags.writeable = False
+    return arrays if len(arrays) > 1 else arrays[0]
+
+@st.cache_resource(show_spinner=False)
+def get_time_grid(t_end, n_points):
+    return _read_only(np.linspace(0, t_end, n_points))
+
+@st.cache_resource(show_spinner=False)
+def fed_batch_grid(exchange_time, total_time=50, n_phase=250):
+    # Batch phase before exchange, the exchange event itself, then batch phase after exchange
+    t_results = np.empty(2 * n_phase)
+    t_results[:n_phase] = np.linspace(0, exchange_time, n_phase)
+    t_results[n_phase:] = np.linspace(exchange_time, total_time, n_phase)
+    exchange_at = np.zeros(len(t_results), dtype=bool)
+    exchange_at[n_phase] = True
+    return _read_only(t_results, exchange_at)
+
+@st.cache_resource(show_spinner=False)
+def repeated_fed_batch_grid(first_harvest_time, subsequent_harvest_time, num_cycles):
+    # Initial batch phase, then per cycle: a harvest/feed event followed by a batch phase
+    n_first = int(first_harvest_time * 10)
+    t_subsequent_cycle = np.linspace(0, subsequent_harvest_time, int(subsequent_harvest_time * 10))
+    cycle_length = len(t_subsequent_cycle)
+
+    t_total = np.empty(n_first + num_cycles * cycle_length)
+    t_total[:n_first] = np.linspace(0, first_harvest_time, n_first)
+    current_time_offset = t_total[n_first - 1]
+    for start in range(n_first, len(t_total), cycle_length):
+        t_total[start] = current_time_offset
+        t_total[start + 1:start + cycle_length] = t_subsequent_cycle[1:] + current_time_offset
+        current_time_offset = t_total[start + cycle_length - 1]
+
+    exchange_at = np.zeros(len(t_total), dtype=bool)
+    exchange_at[n_first::cycle_length] = True
+    return _read_only(t_total, exchange_at)
+
+def perfusion_problem(initial_substrate, initial_biomass, initial_volume, mu_max, ks, Y_xs, Y_xp,
+                      feed_rate, feed_substrate, bleed_rate, cell_retention):
+    """Initial state and packed kinetics parameters (see kinetics._perfusion_rhs) of a perfusion run."""
+    # Operating parameters
+    V = initial_volume            # L
+    F = feed_rate                 # L/h
+    B = bleed_rate                # L/h
+    D = F / V                     # Feed dilution rate (1/h)
+    D_bleed = B / V               # Bleed dilution rate (1/h)
+    Sf = feed_substrate           # Feed substrate (g/L)
+    R = cell_retention            # Cell retention fraction
+
+    # Initial state [X, S, P]
+    y0 = np.array([initial_biomass, initial_substrate, 0.0])  # Start with no product
+
+    # Crash detection starts from the larger of the feed and initial substrate
+    return y0, np.array([mu_max, ks, Y_xs, Y_xp, D, Sf, R, D_bleed, max(Sf, initial_substrate)])
+
+def perfusion_stop_level(initial_substrate):
+    """Substrate level below which a perfusion run counts as depleted and stops."""
+    return initial_substrate * 0.008
+
+def perfusion_run_length(S, initial_substrate):
+    """Number of points a perfusion run keeps: it stops once substrate is depleted."""
+    depleted = S < perfusion_stop_level(initial_substrate)
+    return np.argmax(depleted) if depleted.any() else len(S)
+
+def perfusion_crash_threshold(params):
+    # Substrate in a perfusion reactor never rises above the larger of the feed and
+    # initial concentrations, so that is the peak the crash criterion is relative to.
+    S_max = max(params['feed_substrate'], params['initial_substrate'])
+    return 0.000015 * S_max, S_max
+
+# Kinetic parameters that vary from run to run, and the bounds they are kept within
+VARIED_PARAMS = ('mu_max', 'ks', 'Y_xs', 'Y_xp')
+VARIED_MIN = np.array([0.01, 0.01, 0.1, 0.01])
+VARIED_MAX = np.array([np.inf, np.inf, 1.0, 1.0])
+
+def apply_variability(params, rng):
+    """Return a copy of params with natural run-to-run variability applied to the kinetic parameters."""
     # Create a mutable copy of params to apply variability
     sim_params = params.copy()
 
     # Automatically apply a random variability strength between 0% and 20% for each run.
-    variability_strength = np.random.uniform(0, 20) / 100.0 # Convert percentage to fraction
-    
-    # Apply variability to relevant parameters
-    # Keys to vary: mu_max, ks, Y_xs, Y_xp
-    # Ensure they remain positive and within reasonable bounds
-    
-    # mu_max
-    if 'mu_max' in sim_params:
-        original_value = sim_params['mu_max']
-        random_factor = np.random.normal(0, variability_strength)
-        varied_value = original_value * (1 + random_factor)
-        sim_params['mu_max'] = max(0.01, varied_value) # Ensure positive
-
-    # ks
-    if 'ks' in sim_params:
-        original_value = sim_params['ks']
-        random_factor = np.random.normal(0, variability_strength)
-        varied_value = original_value * (1 + random_factor)
-        sim_params['ks'] = max(0.01, varied_value) # Ensure positive
-
-    # Y_xs
-    if 'Y_xs' in sim_params:
-        original_value = sim_params['Y_xs']
-        random_factor = np.random.normal(0, variability_strength)
-        varied_value = original_value * (1 + random_factor)
-        sim_params['Y_xs'] = max(0.1, min(1.0, varied_value)) # Ensure between 0.1 and 1.0
-
-    # Y_xp
-    if 'Y_xp' in sim_params:
-        original_value = sim_params['Y_xp']
-        random_factor = np.random.normal(0, variability_strength)
-        varied_value = original_value * (1 + random_factor)
-        sim_params['Y_xp'] = max(0.01, min(1.0, varied_value)) # Ensure between 0.01 and 1.0
-
-
-    df = pd.DataFrame()
-    product_name = params.get('product_name', 'Product')
-
-    if mode == "Batch":
-        y0 = [sim_params['initial_biomass'], sim_params['initial_substrate'], 0.0]
-        sol = odeint(batch_kinetics, y0, t_span, args=(sim_params['mu_max'], sim_params['ks'], sim_params['Y_xs'], sim_params['Y_xp']))
-        X, S, P = sol[:, 0], sol[:, 1], sol[:, 2]
-        df = pd.DataFrame({"Time (h)": t_span, "Biomass (g/L)": X, "Substrate (g/L)": S, f"{product_name} (g/L)": P})
-
-    elif mode == "Fed-Batch":
-        total_time = 50
-        exchange_time = sim_params.get('exchange_time', 25)
-
-        y0 = [sim_params['initial_biomass'], sim_params['initial_substrate'], 0.0]
-        V = sim_params['initial_volume']
-
-        # 1. Batch phase before exchange
-        t_before = np.linspace(0, exchange_time, 250) 
-        sol_before = odeint(batch_kinetics, y0, t_before, args=(sim_params['mu_max'], sim_params['ks'], sim_params['Y_xs'], sim_params['Y_xp']))
-
-        # Store results
-        t_results = list(t_before)
-        x_results = list(sol_before[:, 0])
-        s_results = list(sol_before[:, 1])
-        p_results = list(sol_before[:, 2])
-        v_results = [V] * len(t_before) # Volume is constant during batch phase
-
-        # 2. Apply the 20% volume exchange
-        y_before_exchange = sol_before[-1] 
-        X_before, S_before, P_before = y_before_exchange[0], y_before_exchange[1], y_before_exchange[2]
-        
-        exchange_volume_percent = sim_params.get('exchange_volume_percent', 20)
-        exchange_fraction = exchange_volume_percent / 100.0
-        keep_fraction = 1.0 - exchange_fraction
-
-        # Concentrations after exchange
-        S_after = keep_fraction * S_before + exchange_fraction * sim_params['feed_substrate']
-        X_after = keep_fraction * X_before
-        P_after = keep_fraction * P_before
-        
-        # Volume does not change in this model of exchange
-        V_after_exchange = V 
-
-        # Add a point for the event
-        t_results.append(exchange_time)
-        x_results.append(X_after)
-        s_results.append(S_after)
-        p_results.append(P_after)
-        v_results.append(V_after_exchange)
-
-        # 3. Batch phase after exchange
-        y0_after = [X_after, S_after, P_after]
-        
-        t_after = np.linspace(exchange_time, total_time, 250)
-        sol_after = odeint(batch_kinetics, y0_after, t_after, args=(sim_params['mu_max'], sim_params['ks'], sim_params['Y_xs'], sim_params['Y_xp']))
-
-        # Append results
-        t_results.extend(t_after[1:])
-        x_results.extend(sol_after[1:, 0])
-        s_results.extend(sol_after[1:, 1])
-        p_results.extend(sol_after[1:, 2])
-        v_results.extend([V_after_exchange] * (len(t_after) - 1))
-
-        df = pd.DataFrame({
-            "Time (h)": t_results,
-            "Biomass (g/L)": x_results,
-            "Substrate (g/L)": s_results,
-            f"{product_name} (g/L)": p_results,
-            "Volume (L)": v_results
-        })
-
-    elif mode == "Repeated Fed-Batch":
-        first_harvest_time = sim_params.get('first_harvest_time', 24)
-        subsequent_harvest_time = sim_params.get('subsequent_harvest_time', 24)
-        num_cycles = sim_params.get('num_cycles', 3)
-        harvest_volume_percent = sim_params.get('harvest_volume_percent', 20)
-
-        t_total, X_total, S_total, P_total, V_total = [], [], [], [], []
-        
-        y0 = [sim_params['initial_biomass'], sim_params['initial_substrate'], 0.0]
-        V0 = sim_params['initial_volume']
-
-        current_time_offset = 0
-
-        # Initial batch phase
-        t_first_cycle = np.linspace(0, first_harvest_time, int(first_harvest_time * 10))
-        sol = odeint(batch_kinetics, y0, t_first_cycle, args=(sim_params['mu_max'], sim_params['ks'], sim_params['Y_xs'], sim_params['Y_xp']))
-
-        # Record results
-        t_total.extend(t_first_cycle + current_time_offset)
-        X_total.extend(sol[:, 0])
-        S_total.extend(sol[:, 1])
-        P_total.extend(sol[:, 2])
-        V_total.extend([V0] * len(t_first_cycle))
-
-        current_time_offset = t_total[-1]
+    variability_strength = rng.uniform(0, 20) / 100.0 # Convert percentage to fraction
 
-        for i in range(num_cycles):
-            # Harvest and Feed
-            X_before, S_before, P_before = X_total[-1], S_total[-1], P_total[-1]
-            V_before = V_total[-1]
+    # Perturb mu_max, ks, Y_xs and Y_xp by independent normal factors in one draw,
+    # keeping them positive and the yields at most 1.0
+    random_factors = rng.normal(0, variability_strength, size=len(VARIED_PARAMS))
+    values = np.array([sim_params[k] for k in VARIED_PARAMS]) * (1 + random_factors)
+    sim_params.update(zip(VARIED_PARAMS, np.clip(values, VARIED_MIN, VARIED_MAX).tolist()))
 
-            harvest_volume = V_before * (harvest_volume_percent / 100.0)
-            feed_volume = harvest_volume  # Symmetric exchange
-
-            V_after_harvest = V_before - harvest_volume
-            
-            # Dilution from harvesting
-            X_after_harvest = X_before
-            S_after_harvest = S_before
-            P_after_harvest = P_before
-
-            # Refeeding (dilution)
-            V_after_feed = V_after_harvest + feed_volume
-            
-            S_after_feed = (S_after_harvest * V_after_harvest + sim_params['feed_substrate'] * feed_volume) / V_after_feed
-            X_after_feed = X_after_harvest * V_after_harvest / V_after_feed # This should be X_after_harvest * (V_after_harvest / V_after_feed)
-            P_after_feed = P_after_harvest * V_after_harvest / V_after_feed
-
-            y0 = [X_after_feed, S_after_feed, P_after_feed]
-            V0 = V_after_feed
-
-            # Add a point for the event
-            t_total.append(current_time_offset)
-            X_total.append(y0[0])
-            S_total.append(y0[1])
-            P_total.append(y0[2])
-            V_total.append(V0)
-
-            # Subsequent batch phase
-            t_subsequent_cycle = np.linspace(0, subsequent_harvest_time, int(subsequent_harvest_time * 10))
-            sol = odeint(batch_kinetics, y0, t_subsequent_cycle, args=(sim_params['mu_max'], sim_params['ks'], sim_params['Y_xs'], sim_params['Y_xp']))
-
-            # Record results
-            t_to_add = t_subsequent_cycle[1:] + current_time_offset
-            t_total.extend(t_to_add)
-            X_total.extend(sol[1:, 0])
-            S_total.extend(sol[1:, 1])
-            P_total.extend(sol[1:, 2])
-            V_total.extend([V0] * len(t_subsequent_cycle[1:]))
-            
-            current_time_offset = t_total[-1]
+    return sim_params
 
+def batch_type_schedule(mode, params):
+    """Time grid, exchange flags, exchange fraction, feed substrate and reported volume of a batch-type run."""
+    if mode == "Batch":
+        t = get_time_grid(50, 500)
+        return t, np.zeros(len(t), dtype=bool), 0.0, 0.0, None
+    if mode == "Fed-Batch":
+        t, exchange_at = fed_batch_grid(params['exchange_time'])
+        fraction = params['exchange_volume_percent'] / 100.0
+    else:
+        t, exchange_at = repeated_fed_batch_grid(params['first_harvest_time'], params['subsequent_harvest_time'],
+                                                 params['num_cycles'])
+        fraction = params['harvest_volume_percent'] / 100.0
+    return t, exchange_at, fraction, params['feed_substrate'], params['initial_volume']
 
-        df = pd.DataFrame({"Time (h)": t_total, "Biomass (g/L)": X_total, "Substrate (g/L)": S_total, f"{product_name} (g/L)": P_total, "Volume (L)": V_total})
-
-
-    elif mode == "Bleed-Perfusion":
-        # Reset perfusion model state
-        if hasattr(perfusion_kinetics, 'S_max'):
-            delattr(perfusion_kinetics, 'S_max')
-        perfusion_kinetics.crashed = False
-
-        # Operating parameters
-        V = sim_params['initial_volume']  # L
-        F = sim_params['feed_rate']       # L/h
-        B = sim_params['bleed_rate']      # L/h
-        D = F / V                     # Feed dilution rate (1/h)
-        D_bleed = B / V               # Bleed dilution rate (1/h)
-        Sf = sim_params['feed_substrate'] # Feed substrate (g/L)
-        R = sim_params['cell_retention']  # Cell retention fraction
-
-        # Initial state [X, S, P]
-        y0 = [sim_params['initial_biomass'], 
-              sim_params['initial_substrate'],
-              0.0]  # Start with no product
-
-        # Initialize crash detection
-        perfusion_kinetics.S_max = max(Sf, sim_params['initial_substrate'])
-        
-        # Solve ODEs
-        sol = odeint(
-            perfusion_kinetics,
-            y0,
-            t_span,
-            args=(
-                sim_params['mu_max'],
-                sim_params['ks'],
-                sim_params['Y_xs'],
-                sim_params['Y_xp'],
-                D,
-                Sf,
-                R,
-                D_bleed
-            ),
-        )
-        X, S, P = sol[:, 0], sol[:, 1], sol[:, 2]
-
-        # Stop simulation when substrate is depleted
-        stop_threshold = sim_params.get('initial_substrate', 10.0) * 0.008
-        stop_point = np.where(S < stop_threshold)
-
-        if len(stop_point[0]) > 0:
-            stop_index = stop_point[0][0]
-            t_span = t_span[:stop_index]
-            X = X[:stop_index]
-            S = S[:stop_index]
-            P = P[:stop_index]
-
-        df = pd.DataFrame({"Time (h)": t_span, "Biomass (g/L)": X, "Substrate (g/L)": S, f"{product_name} (g/L)": P})
-    
-    return df
+def integrate_batch_type(runs):
+    """
+    Integrate batch-type runs, given as (varied params, schedule) pairs, together in a
+    single parallel kernel call. Their time grids differ in length, so the trajectories
+    come back concatenated: returns (offsets, t_all, sol), run k spanning
+    offsets[k]:offsets[k + 1].
+    """
+    y0s = np.array([[p['initial_biomass'], p['initial_substrate'], 0.0] for p, _ in runs])
+    kinetic_params = np.array([[p['mu_max'], p['ks'], p['Y_xs'], p['Y_xp']] for p, _ in runs])
+    offsets = np.zeros(len(runs) + 1, dtype=np.int64)
+    np.cumsum([len(schedule[0]) for _, schedule in runs], out=offsets[1:])
+    t_all = np.empty(offsets[-1])
+    exchange_all = np.empty(offsets[-1], dtype=bool)
+    for k, (_, (t, exchange_at, _, _, _)) in enumerate(runs):
+        t_all[offsets[k]:offsets[k + 1]] = t
+        exchange_all[offsets[k]:offsets[k + 1]] = exchange_at
+    sol = integrate_many(y0s, t_all, offsets, kinetic_params, exchange_all,
+                         np.array([schedule[2] for _, schedule in runs]),
+                         np.array([schedule[3] for _, schedule in runs], dtype=float))
+    return offsets, t_all, sol
+
+def integrate_perfusion_runs(runs):
+    """
+    Integrate perfusion runs, given as varied params, together in a single parallel
+    kernel call on the shared 50 h grid. Each run stops once its substrate is depleted:
+    returns (t, sol, lengths), run k keeping sol[k, :lengths[k]].
+    """
+    problems = [perfusion_problem(p['initial_substrate'], p['initial_biomass'], p['initial_volume'],
+                                  p['mu_max'], p['ks'], p['Y_xs'], p['Y_xp'],
+                                  p['feed_rate'], p['feed_substrate'], p['bleed_rate'], p['cell_retention'])
+                 for p in runs]
+    t = get_time_grid(50, 500)
+    sol = integrate_perfusion_many(np.array([y0 for y0, _ in problems]), t, np.array([p for _, p in problems]),
+                                   np.array([perfusion_stop_level(p['initial_substrate']) for p in runs]))
+    lengths = np.array([perfusion_run_length(s[:, 1], p['initial_substrate']) for s, p in zip(sol, runs)])
+    return t, sol, lengths
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def simulate_scenarios(scenarios):
+    """
+    Simulate a list of (mode, params) pairs, e.g. the overlay scenarios. The batch-type
+    modes share one kinetic model, so they are integrated together in a single parallel
+    kernel call, as are the perfusion scenarios. Each scenario's
+    variability is seeded like a main run 1, so overlays stay put across reruns.
+    Returns one DataFrame per scenario, in order.
+    """
+    results = [None] * len(scenarios)
+    batched, runs = [], []
+    perfusion, perfusion_runs = [], []
+    for idx, (scenario_mode, scenario_params) in enumerate(scenarios):
+        params = {**MODE_DEFAULTS[scenario_mode], **scenario_params}
+        if scenario_mode == "Bleed-Perfusion":
+            perfusion.append(idx)
+            perfusion_runs.append(apply_variability(params, np.random.default_rng(0)))
+            continue
+        batched.append(idx)
+        runs.append((apply_variability(params, np.random.default_rng(0)), batch_type_schedule(scenario_mode, params)))
+
+    if batched:
+        offsets, t_all, sol = integrate_batch_type(runs)
+        for k, idx in enumerate(batched):
+            a, b = offsets[k], offsets[k + 1]
+            results[idx] = trajectory_frame(t_all[a:b], sol[a:b], scenarios[idx][1].get('product_name', 'Product'),
+                                            volume=runs[k][1][4])
+    if perfusion:
+        t, sol, lengths = integrate_perfusion_runs(perfusion_runs)
+        for k, idx in enumerate(perfusion):
+            n = lengths[k]
+            results[idx] = trajectory_frame(t[:n], sol[k, :n], scenarios[idx][1].get('product_name', 'Product'))
+    return results
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def simulate_runs(mode, params, num_runs):
+    """
+    Simulate num_runs runs of one mode, run i with its variability seeded by i, stacked
+    in a single DataFrame with a 1-based 'Run' column. The runs share a time grid and
+    are integrated together in one parallel kernel call.
+    """
+    full_params = {**MODE_DEFAULTS[mode], **params}
+    if mode == "Bleed-Perfusion":
+        t, sol, lengths = integrate_perfusion_runs(
+            [apply_variability(full_params, np.random.default_rng(i)) for i in range(num_runs)])
+
+        # Runs stop at different points; keep each one's points up to its stop
+        keep = np.arange(len(t)) < lengths[:, None]
+        return trajectory_frame(np.broadcast_to(t, keep.shape)[keep], sol[keep], params.get('product_name', 'Product'),
+                                run=np.repeat(np.arange(1, num_runs + 1), lengths))
+
+    schedule = batch_type_schedule(mode, full_params)
+    runs = [(apply_variability(full_params, np.random.default_rng(i)), schedule) for i in range(num_runs)]
+    _, t_all, sol = integrate_batch_type(runs)
+    return trajectory_frame(t_all, sol, params.get('product_name', 'Product'), volume=schedule[4],
+                            run=np.repeat(np.arange(1, num_runs + 1), len(schedule[0])))
 
 # --- Main Content Area ---
 st.header(f"Simulation Results for {mode} Mode")
@@ -1193,40 +812,58 @@ with st.sidebar.expander("🎨 Visualization Settings", expanded=True):
 # --- Overlay Scenarios ---
 overlay_scenarios = st.sidebar.multiselect("Overlay Scenarios", scenario_names, help="Select saved scenarios to plot alongside the current simulation. Note: Overlay is disabled when Number of Runs > 1.")
 
-all_runs_df = []
-for i in range(num_runs):
-    df_run = run_simulation(mode, current_params)
-    df_run['Run'] = i + 1
-    all_runs_df.append(df_run)
-df_main = pd.concat(all_runs_df, ignore_index=True)
+df_main = simulate_runs(mode, current_params, num_runs)
+
+# Runs are stacked in order: slice each one out once (views, no copies) for the plot and the metrics
+run_starts = np.flatnonzero(np.diff(df_main['Run'].to_numpy(), prepend=0))
+run_dfs = [df_main.iloc[a:b] for a, b in zip(run_starts, [*run_starts[1:], len(df_main)])]
+
+# SVG line traces get sluggish in the browser past a few thousand points; long
+# traces (e.g. multi-cycle runs) are drawn with the WebGL renderer instead, and
+# anything beyond MAX_PLOT_POINTS is LTTB-downsampled before it is sent to the browser.
+WEBGL_MIN_POINTS = 1000
+MAX_PLOT_POINTS = 2000
+
+def line_trace(x, y, **kwargs):
+    if len(x) > MAX_PLOT_POINTS:
+        keep = lttb_indices(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), MAX_PLOT_POINTS)
+        x, y = x[keep], y[keep]
+    trace_type = go.Scattergl if len(x) > WEBGL_MIN_POINTS else go.Scatter
+    # The concentrations already come out of the kernels as float32; sending the time
+    # axis as float32 too trims the figure payload by a third, invisibly at plot scale
+    return trace_type(x=x.astype(np.float32, copy=False), y=y, mode='lines', **kwargs)
 
 col1, col2 = st.columns(2)
 with col1:
     with st.expander("📈 Visualization Panel", expanded=True):
-        fig = go.Figure()
-    
-        # Plot main simulation
-        for run_num in df_main['Run'].unique():
-            run_df = df_main[df_main['Run'] == run_num]
+        # Collect the traces and hand them to plotly in one go: adding them one at a
+        # time re-validates the figure on every call, which adds up with many runs
+        traces = []
+
+        # Plot main simulation (plotly gets the columns' numpy arrays, not pandas Series)
+        for run_num, run_df in enumerate(run_dfs, start=1):
+            t = run_df["Time (h)"].to_numpy()
             for col in run_df.columns:
                 if col not in ["Time (h)", "Run", "Volume (L)"]:
-                    # Convert numpy.bool_ to Python bool for Plotly compatibility
-                    fig.add_trace(go.Scatter(x=run_df["Time (h)"], y=run_df[col], mode='lines', name=f"Run {run_num} - {col}", showlegend=True, line=dict(width=2 if num_runs == 1 else 1.5)))
+                    traces.append(line_trace(t, run_df[col].to_numpy(), name=f"Run {run_num} - {col}", showlegend=True, line=dict(width=2 if num_runs == 1 else 1.5)))
 
         # Plot overlay scenarios (only if num_runs is 1)
-        if num_runs == 1:
-            for scenario in overlay_scenarios:
-                scenario_data = st.session_state.scenarios[scenario]
-                df_overlay = run_simulation(scenario_data['mode'], scenario_data['params'])
+        if num_runs == 1 and overlay_scenarios:
+            overlay_dfs = simulate_scenarios([(st.session_state.scenarios[scenario]['mode'], st.session_state.scenarios[scenario]['params'])
+                                              for scenario in overlay_scenarios])
+            for scenario, df_overlay in zip(overlay_scenarios, overlay_dfs):
+                t = df_overlay["Time (h)"].to_numpy()
                 for col in df_overlay.columns:
                     if col not in ["Time (h)", "Run", "Volume (L)"]:
-                        fig.add_trace(go.Scatter(x=df_overlay["Time (h)"], y=df_overlay[col], mode='lines', name=f"{scenario} - {col}", line=dict(dash='dash')))
+                        traces.append(line_trace(t, df_overlay[col].to_numpy(), name=f"{scenario} - {col}", line=dict(dash='dash')))
 
         if show_inflection_points and not df_main.empty:
-            first_run_df = df_main[df_main['Run'] == 1]
+            first_run_df = run_dfs[0]
             max_biomass_idx = first_run_df['Biomass (g/L)'].idxmax()
             max_biomass_time, max_biomass_val = first_run_df.loc[max_biomass_idx, ['Time (h)', 'Biomass (g/L)']]
-            fig.add_trace(go.Scatter(x=[max_biomass_time], y=[max_biomass_val], mode='markers', name='Max Biomass', marker=dict(size=10, color='red')))
+            traces.append(go.Scatter(x=[max_biomass_time], y=[max_biomass_val], mode='markers', name='Max Biomass', marker=dict(size=10, color='red')))
+
+        fig = go.Figure(data=traces)
 
         if show_annotations and not df_main.empty and mode == "Batch":
             fig.add_annotation(x=df_main["Time (h)"][int(len(df_main)/4)], y=df_main['Biomass (g/L)'][int(len(df_main)/4)],
@@ -1236,9 +873,9 @@ with col1:
         st.plotly_chart(fig, use_container_width=True)
 
         # Culture Status Indicators (moved here for immediate visibility)
-        if mode == "Bleed-Perfusion" and hasattr(perfusion_kinetics, 'S_max'):
+        if mode == "Bleed-Perfusion":
             st.markdown("### 🔬 Culture Status")
-            S_threshold = 0.000015 * getattr(perfusion_kinetics, 'S_max', 0)
+            S_threshold, S_max = perfusion_crash_threshold(current_params)
             current_S = df_main['Substrate (g/L)'].iloc[-1]
         
             if current_S <= S_threshold:
@@ -1251,7 +888,7 @@ with col1:
                 📊 Status Details:
                 - Current substrate: {current_S:.4f} g/L
                 - Crash threshold: {S_threshold:.4f} g/L
-                - Peak substrate seen: {perfusion_kinetics.S_max:.1f} g/L
+                - Peak substrate seen: {S_max:.1f} g/L
                 - Condition: No cell growth, no product formation
                 - Action: Culture washout in progress
                 """)
@@ -1276,8 +913,7 @@ with st.expander("📊 Process Performance", expanded=False):
     
     # Calculate metrics for each run
     all_metrics = []
-    for run_num in df_main['Run'].unique():
-        run_df = df_main[df_main['Run'] == run_num].reset_index(drop=True)
+    for run_num, run_df in enumerate(run_dfs, start=1):
         metrics = calculate_productivity_metrics(run_df, mode, current_params)
         metrics['Run'] = run_num
         all_metrics.append(metrics)
@@ -1286,13 +922,15 @@ with st.expander("📊 Process Performance", expanded=False):
         metrics_df = pd.DataFrame(all_metrics)
         metrics_df_display = metrics_df.set_index('Run') # Use a separate df for display
         # Set 'Run' as the index for better display
-        st.dataframe(metrics_df_display.style.format("{:.4f}"))
+        # Format on the client instead of through a Styler, which renders every cell in Python
+        st.dataframe(metrics_df_display, column_config={
+            col: st.column_config.NumberColumn(format="%.4f") for col in metrics_df_display.columns
+        })
 
         # Display crash warnings based on the last run's data
-        if mode == "Bleed-Perfusion" and hasattr(perfusion_kinetics, 'S_max'):
-            S_threshold = 0.000015 * getattr(perfusion_kinetics, 'S_max', 0)
-            last_run_df = df_main[df_main['Run'] == num_runs]
-            current_S = last_run_df['Substrate (g/L)'].iloc[-1]
+        if mode == "Bleed-Perfusion":
+            S_threshold, _ = perfusion_crash_threshold(current_params)
+            current_S = df_main['Substrate (g/L)'].iloc[-1]  # runs are stacked in order
             if current_S <= S_threshold:
                 st.error(f"⚠️ CULTURE CRASH DETECTED in the final run (Run {num_runs})!")
             elif current_S < 5 * S_threshold:
@@ -1303,7 +941,7 @@ with st.expander("📊 Process Performance", expanded=False):
 
 with st.expander("🔄 Mode Comparison", expanded=False):
     comparison_data = {
-        "Mode": ["Batch", "Fed-Batch", "Repeated Fed-Batch", "Bleed-Perfusion"],
+        "Mode": list(MODES),
         "Fresh Medium Introduction": ["Single addition at start", "Gradual or pulsed feeding", "Periodic feeding after each cycle", "Continuous"],
         "Spent Medium Removal": ["None during process", "None during process", "Partial removal between cycles", "Continuous"],
         "Cell Harvesting": ["At end of run; entire culture", "At end of run; entire culture", "Partial harvest after each cycle", "Continuous bleed stream"],
@@ -1314,69 +952,56 @@ with st.expander("🔄 Mode Comparison", expanded=False):
 
 with st.expander("📝 Assignment Questions", expanded=False):
     if assignment_mode:
-        questions = {
-            "Batch": [
-                "Why does the biomass concentration plateau in batch culture?",
-                "What limits the final biomass concentration achieved?",
-                "How would increasing the initial substrate concentration affect the results?"
-            ],
-            "Fed-Batch": [
-                "How does the feeding strategy affect biomass productivity?",
-                "What are the advantages of fed-batch over batch culture?",
-                "How would you optimize the feed rate for maximum productivity?"
-            ],
-            "Repeated Fed-Batch": [
-                "What are the benefits of multiple cycles compared to single batch?",
-                "How does the harvest volume affect overall productivity?",
-                "What factors determine the optimal cycle time?"
-            ],
-            "Bleed-Perfusion": [
-                "Why can perfusion systems achieve the highest productivity?",
-                "How does cell retention efficiency affect the process?",
-                "What are the main challenges in operating perfusion systems?"
-            ]
-        }
-    
-        for i, question in enumerate(questions[mode]):
-            st.write(f"**Question {i+1}:** {question}")
-            st.text_area(f"Answer {i+1}:", key=f"answer_{i}")
+        for i, question in enumerate(ASSIGNMENT_QUESTIONS[mode]):
+            st.text_area(f"**Question {i+1}:** {question}", key=f"answer_{i}")
     
         st.text_area("Overall interpretation of the results:", key="overall_interpretation")
 
 # --- Glossary Expander ---
 with st.expander("Glossary"):
-    for term, definition in glossary.items():
-        st.markdown(f"**{term}**: {definition}")
-
-# --- Scenario Builder and Export Tool ---
-with st.sidebar.expander("🛠️ Scenario Builder", expanded=False):
-    scenario_name = st.text_input("Enter scenario name to save", "MyScenario")
-    if st.button("Save Scenario"):
-        st.session_state.scenarios[scenario_name] = {"mode": mode, "params": current_params}
-        save_scenarios(st.session_state.scenarios)
-        st.success(f"Scenario '{scenario_name}' saved to scenarios.json!")
-
-    # --- Import Scenarios (remains in sidebar) ---
-    with st.sidebar.expander("📥 Import Scenarios", expanded=False):
-        uploaded_file = st.file_uploader("Upload scenario file", type="json")
-        if uploaded_file is not None:
-            try:
-                uploaded_scenarios = json.load(uploaded_file)
-                st.session_state.scenarios.update(uploaded_scenarios)
-                save_scenarios(st.session_state.scenarios)
-                st.success(f"Imported {len(uploaded_scenarios)} scenarios!")
-            except json.JSONDecodeError:
-                st.error("Invalid JSON file format")
+    st.markdown(GLOSSARY_MD)
+
+# --- Import Scenarios (remains in sidebar) ---
+with st.sidebar.expander("📥 Import Scenarios", expanded=False):
+    uploaded_file = st.file_uploader("Upload scenario file", type="json")
+    # The file stays in the uploader across reruns; import (and save) it only once
+    if uploaded_file is not None and uploaded_file.file_id != st.session_state.get('imported_file_id'):
+        try:
+            uploaded_scenarios = orjson.loads(uploaded_file.getvalue())
+            st.session_state.scenarios.update(uploaded_scenarios)
+            save_scenarios(st.session_state.scenarios)
+            st.session_state.imported_file_id = uploaded_file.file_id
+            st.success(f"Imported {len(uploaded_scenarios)} scenarios!")
+        except orjson.JSONDecodeError:
+            st.error("Invalid JSON file format")
 
 # --- Export Tools (moved to main panel) ---
+# Download buttons need their data on every rerun; the encoded CSV is cached so it is
+# only rebuilt when the frame changes. pandas writes it to the buffer in row chunks,
+# so the whole file never also sits in memory as one str.
+@st.cache_data(max_entries=8, show_spinner=False)
+def csv_bytes(df, chunk_rows=50_000):
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8", chunksize=chunk_rows)
+    return buf.getvalue()
+
+# Parquet stores the floats in binary columns, so it skips the text formatting that
+# dominates CSV export and comes out several times smaller. pyarrow ships with streamlit.
+@st.cache_data(max_entries=8, show_spinner=False)
+def parquet_bytes(df):
+    buf = io.BytesIO()
+    df.to_parquet(buf, engine="pyarrow", compression="snappy", index=False)
+    return buf.getvalue()
+
 with st.expander("📥 Export Data", expanded=False):
     export_col1, export_col2 = st.columns(2)
     with export_col1:
         st.markdown("##### Full Simulation Data")
-        st.download_button("Download as CSV", df_main.to_csv(index=False), "simulation_data.csv", "text/csv", use_container_width=True)
+        st.download_button("Download as CSV", csv_bytes(df_main), "simulation_data.csv", "text/csv", use_container_width=True)
+        st.download_button("Download as Parquet", parquet_bytes(df_main), "simulation_data.parquet", "application/octet-stream", use_container_width=True)
     with export_col2:
         st.markdown("##### Process Metrics Data")
-        st.download_button("Download as CSV", metrics_df.to_csv(index=False), "process_metrics.csv", "text/csv", use_container_width=True, disabled=metrics_df.empty)
+        st.download_button("Download as CSV", csv_bytes(metrics_df) if not metrics_df.empty else b"", "process_metrics.csv", "text/csv", use_container_width=True, disabled=metrics_df.empty)
 
 # --- Footer ---
 st.markdown("---")